@@ -1,29 +1,32 @@
 import random
 import logging
-from abc import ABC, abstractmethod
+from collections import defaultdict
 from dataclasses import dataclass
+from typing import Protocol
 
-from rt.state import Move
+from rt.state import BOARD_SIZE, Move, find_flips_ind, find_move_board, has_moves
+from rt.tt import EXACT, LOWER, UPPER, TranspositionTable
 
 
 logger = logging.getLogger(__name__)
 
 
-class Agent(ABC):
-    @abstractmethod
-    def __init__(self, player):
-        raise NotImplementedError
+class Agent(Protocol):
+    """The interface of an agent, the part of an engine that plays the game.
+
+    Agents do not need to inherit from this class, any class with these
+    methods is an agent. An agent is created for a player by an agent factory,
+    see `Engine`.
+    """
 
-    @abstractmethod
     def set_state(self, state):
-        raise NotImplementedError
+        ...
 
-    @abstractmethod
-    def search(self, btime, wtime, binc, winc):
-        raise NotImplementedError
+    def search(self, btime, wtime, binc, winc) -> str:
+        ...
 
 
-class RandomAgent(Agent):
+class RandomAgent:
     def __init__(self, player):
         self.player = player
         self.state = None
@@ -43,11 +46,11 @@ INF_SCORE = 65
 
 @dataclass
 class DfsResult:
-    """The result from a depth-first search."""
+    """The result from an iterative deepening search."""
     moves: tuple[Move]
-    """The moves performed in this branch of the DFS."""
+    """The principal variation, the moves that are expected to be played."""
     score: int
-    """The score for this branch of DFS."""
+    """The score for the principal variation."""
     remaining: bool
     """True if the search could have gone deeper.
 
@@ -57,115 +60,482 @@ class DfsResult:
     """
 
 
+TT_SIZE = 1 << 18
+"""The maximum number of entries in the transposition table."""
+TT = TranspositionTable(TT_SIZE)
+"""The transposition table.
+
+The scores are from the perspective of the player to move so the table can be
+shared by all searches, it is kept between iterations and searches.
+"""
+
+
+def score_boards(my_board, opponent_board):
+    """An estimation of the score of a state from the boards of the players.
+
+    The score is the difference in the number of tokens, counted directly on
+    the boards since it is evaluated for every leaf of the search.
+    """
+    return my_board.bit_count() - opponent_board.bit_count()
+
+
 def score_func(state, player):
     """An estimation of the score of the current state for the player."""
-    return state.count(player) - state.count(player.opponent())
+    i = player.index
+    return score_boards(state.boards[i], state.boards[1 - i])
+
+
+def search_frontier(state, player, moves, root_scores=None):
+    """Find the best move when all the states after the moves are leaves.
+
+    Most of the states in a search are leaves, so instead of creating a state
+    for each of them the leaves are scored from the boards after the move.
+
+    Args:
+        state: The state to search from.
+        player: The player to move.
+        moves: The possible moves for the player.
+        root_scores: Only given for the root state, updated with the score of
+                     each move, see `dfs_alpha_beta`.
+
+    Returns:
+        A tuple of the exact score of the state, for the player to move, and
+        the move that gives that score.
+    """
+    i = player.index
+    my_board, opponent_board = state.boards[i], state.boards[1 - i]
+
+    score = -INF_SCORE
+    best_move = None
+    for m in moves:
+        flip_board = m.flip_board
+        leaf_score = score_boards(
+            my_board | (1 << (m.row * BOARD_SIZE + m.col)) | flip_board,
+            opponent_board ^ flip_board,
+        )
+        if root_scores is not None:
+            root_scores[(m.row, m.col)] = leaf_score
+        if leaf_score > score:
+            score = leaf_score
+            best_move = m
+    return score, best_move
+
+
+ENDGAME_EMPTIES = 10
+"""The number of empty positions at which a state is solved to the end of the game."""
+
+
+def solve_boards(my_board, opponent_board, alpha, beta):
+    """Find the exact score of a state by searching to the end of the game.
+
+    The search is done with alpha-beta in negamax form directly on the boards.
+    No states or moves are created since this is only used when there are few
+    empty positions left, where almost all states are close to the end.
+
+    Args:
+        my_board: The positions occupied by the player to move.
+        opponent_board: The positions occupied by the opponent.
+        alpha: The highest value the player to move is guaranteed.
+        beta: The lowest value the opponent can force.
+
+    Returns:
+        The score of the state for the player to move. If the score is outside
+        of the window it is only a bound on the exact score.
+    """
+    move_board = find_move_board(my_board, opponent_board)
+    if not move_board:
+        if not has_moves(opponent_board, my_board):
+            return score_boards(my_board, opponent_board)
+        return -solve_boards(opponent_board, my_board, -beta, -alpha)
+
+    score = -INF_SCORE
+    while move_board:
+        pos = move_board & -move_board
+        move_board ^= pos
+        flip_board = find_flips_ind(pos.bit_length() - 1, my_board, opponent_board)
+        child_score = -solve_boards(
+            opponent_board ^ flip_board,
+            my_board | pos | flip_board,
+            -beta,
+            -alpha,
+        )
+        if child_score > score:
+            score = child_score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    return score
+
+
+def solve_endgame(state, player, moves, alpha, beta):
+    """Find the best move of a state by searching to the end of the game.
+
+    Args:
+        state: The state to search from.
+        player: The player to move.
+        moves: The possible moves for the player, in the order to search them.
+        alpha: The highest value the player to move is guaranteed.
+        beta: The lowest value the opponent can force.
+
+    Returns:
+        A tuple of the score of the state for the player to move and the move
+        that gives that score, see `solve_boards`.
+    """
+    i = player.index
+    my_board, opponent_board = state.boards[i], state.boards[1 - i]
+
+    score = -INF_SCORE
+    best_move = None
+    for m in moves:
+        flip_board = m.flip_board
+        child_score = -solve_boards(
+            opponent_board ^ flip_board,
+            my_board | (1 << (m.row * BOARD_SIZE + m.col)) | flip_board,
+            -beta,
+            -alpha,
+        )
+        if child_score > score:
+            score = child_score
+            best_move = m
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    return score, best_move
+
+
+_CHILD_CACHE = {}
+"""The states after a move in the current search, keyed by (Zobrist hash, row, col)."""
+
+
+def _make_move(state, move):
+    """Return the state after the move, cached for the search."""
+    key = (state.zhash, move.row, move.col)
+    child = _CHILD_CACHE.get(key)
+    if child is None:
+        child = _CHILD_CACHE[key] = state.make_move(move)
+    return child
+
+
+MAX_PLIES = BOARD_SIZE * BOARD_SIZE
+"""The maximum depth of a search, a game can never be longer than this."""
+
+KILLERS = [[None, None] for _ in range(MAX_PLIES)]
+"""The two most recent moves, per depth, that caused a cutoff."""
+HISTORY = defaultdict(int)
+"""How good a move has been at causing cutoffs, keyed by (player index, row, col).
+
+Cutoffs close to the root are weighted higher since they prune more nodes.
+"""
+
+
+def record_cutoff(move, depth, max_depth):
+    """Update the killer moves and the history after a cutoff caused by move."""
+    killers = KILLERS[depth]
+    first = killers[0]
+    if first is None or first.row != move.row or first.col != move.col:
+        killers[1] = first
+        killers[0] = move
+    HISTORY[(move.player.index, move.row, move.col)] += (max_depth - depth) ** 2
+
+
+STATIC_SQ = (
+    100, -20, 10, 5, 5, 10, -20, 100,
+    -20, -50, -2, -2, -2, -2, -50, -20,
+    10, -2, -1, -1, -1, -1, -2, 10,
+    5, -2, -1, -1, -1, -1, -2, 5,
+    5, -2, -1, -1, -1, -1, -2, 5,
+    10, -2, -1, -1, -1, -1, -2, 10,
+    -20, -50, -2, -2, -2, -2, -50, -20,
+    100, -20, 10, 5, 5, 10, -20, 100,
+)
+"""The static value of each position, indexed by row * BOARD_SIZE + col.
+
+Corners are valuable since they can never be flipped while the positions next
+to them give the corner away to the opponent.
+"""
+
+
+def order_moves(moves, first_move, depth):
+    """Yield the moves in the order they should be searched.
+
+    The first move is tried first followed by the killer moves for the depth.
+    The rest are ordered by the static value of their position, see
+    `STATIC_SQ`, then by the number of flipped tokens and then by their
+    history, highest first. Most searches are cut off after one or two moves
+    so the ordering is done lazily, with a selection sort, instead of sorting
+    all moves up front.
+
+    Note:
+        The first move and the killer moves can come from other states, so
+        they are matched to the moves by position only.
 
+    Args:
+        moves: The possible moves. The list is not modified.
+        first_move: The move to try first or None.
+        depth: The depth of the state the moves are made from.
+    """
+    moves = list(moves)
+    start = 0
+    killer0, killer1 = KILLERS[depth]
+    for hint in (first_move, killer0, killer1):
+        if hint is None:
+            continue
+        for i in range(start, len(moves)):
+            m = moves[i]
+            if m.row == hint.row and m.col == hint.col:
+                moves[i] = moves[start]
+                moves[start] = m
+                start += 1
+                yield m
+                break
+
+    # The static value decides the order, the number of flipped tokens and
+    # the history are only used to break ties so they are kept in the lower bits.
+    keys = [
+        (STATIC_SQ[m.row * BOARD_SIZE + m.col] << 40)
+        + (m.flip_board.bit_count() << 32)
+        + HISTORY.get((m.player.index, m.row, m.col), 0)
+        for m in moves
+    ]
+    for i in range(start, len(moves)):
+        best = i
+        for j in range(i + 1, len(moves)):
+            if keys[j] > keys[best]:
+                best = j
+        if best != i:
+            moves[i], moves[best] = moves[best], moves[i]
+            keys[i], keys[best] = keys[best], keys[i]
+        yield moves[i]
+
+
+def order_root_moves(moves, root_scores):
+    """Order the moves from the root state by their scores, highest first.
+
+    Note:
+        The scores of moves after a cutoff or searched with a null window are
+        only bounds, but they are still good enough to order the moves.
 
-def dfs_alpha_beta(state, alpha, beta, depth, player, max_depth, prev_best_variation):
+    Args:
+        moves: The possible moves from the root state.
+        root_scores: A dict from the position (row, col) of each move to its
+                     score in a previous (shallower) search.
+    """
+    return sorted(moves, key=lambda m: root_scores.get((m.row, m.col), -INF_SCORE), reverse=True)
+
+
+def dfs_alpha_beta(state, alpha, beta, depth, max_depth, prev_best_variation, root_scores=None):
     """Perform a depth-limited alpha-beta depth first search.
 
+    The search is done in negamax form. The scores are always from the
+    perspective of the player to move, the opponent of `state.last_played`,
+    and the score of a child is negated to get the score for its parent. The
+    first move is searched with the full window and the rest with a null
+    window (principal variation search). A move is only searched again with
+    the full window if the null window search shows that it is better.
+
     Note:
         The search is recursive, keep the maximum recursion limit in mind. Due
         to the high branching factor this will likely not be an issue though.
 
     Args:
         state: The root state of the search.
-        alpha: The current alpha value. The highest value the maximizing player
+        alpha: The current alpha value. The highest value the player to move
                is guaranteed.
-        beta: The current beta value. The minimum value that the minimizing
-              player can force.
-        player: The player that is searching (maximizing player). Note that
-                this is not the same as next player to take a turn, which is
-                found from the state.
+        beta: The current beta value. The lowest value that the opponent of
+              the player to move can force.
+        depth: The depth of the state in the search.
         max_depth: The maximum depth to search.
         prev_best_variation: The sequence of moves that gave the highest score
                              in a previous (shallower) search.
+        root_scores: Only given for the root state. A dict from the position
+                     (row, col) of each move to its score. If it contains the
+                     scores from a previous (shallower) search the moves are
+                     searched in order of those scores. It is updated with the
+                     scores from this search.
 
     Returns:
-        A DfsResult object containing an estimate of the score and a series of
-        moves, the principal variation. The moves are the moves that would be
-        made by the players to reach the state that was used for estimating the
-        score.
+        A tuple of an estimate of the score, True if the search could have gone
+        deeper (see `DfsResult.remaining`) and the best move or None if there
+        are no moves. Only the best move is returned to avoid building the
+        principal variation at every state, it can be found from the
+        transposition table instead.
     """
+    player = state.last_played.opponent()
     if depth >= max_depth:
-        return DfsResult(
-            moves=tuple(),
-            score=score_func(state, player),
-            remaining=True  # The search was stopped by max_depth so there are most often more nodes.
-        )
+        # The search was stopped by max_depth so there are most often more nodes.
+        return score_func(state, player), True, None
 
     next_player = state.next_player()
     if next_player is None:
-        return DfsResult(
-            moves=tuple(),
-            score=score_func(state, player),
-            remaining=False  # The game has ended so no more nodes.
+        # The game has ended so no more nodes.
+        return score_func(state, player), False, None
+    elif next_player != player:
+        # The player to move has to pass. Passing is not a move so the depth
+        # is not increased.
+        score, remaining, best_move = dfs_alpha_beta(
+            state=state.make_pass(),
+            alpha=-beta,
+            beta=-alpha,
+            depth=depth,
+            max_depth=max_depth,
+            prev_best_variation=prev_best_variation,
+            root_scores=root_scores
         )
+        return -score, remaining, best_move
+
+    search_depth = max_depth - depth
+    tt_move = None
+    entry = TT.get(state)
+    if entry is not None:
+        tt_score, tt_depth, tt_flag, tt_move, tt_remaining = entry
+        if tt_depth >= search_depth:
+            if tt_flag == EXACT:
+                return tt_score, tt_remaining, tt_move
+            elif tt_flag == LOWER:
+                alpha = max(alpha, tt_score)
+            else:
+                beta = min(beta, tt_score)
+            if alpha >= beta:
+                return tt_score, tt_remaining, tt_move
+    # The window the children are searched with, used to classify the result.
+    window_alpha, window_beta = alpha, beta
+
+    moves = state.possible_moves(player)
+    empties = MAX_PLIES - (state.boards[0] | state.boards[1]).bit_count()
+    if empties <= ENDGAME_EMPTIES and empties <= search_depth and root_scores is None:
+        # The search would reach the end of the game anyway, so the state is
+        # solved directly on the boards. The result holds for any search depth
+        # and there are no more nodes to search.
+        score, best_move = solve_endgame(
+            state, player, order_moves(moves, tt_move, depth), alpha, beta
+        )
+        if score <= window_alpha:
+            flag = UPPER
+        elif score >= window_beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        TT.store(state, score, MAX_PLIES, flag, best_move, False)
+        return score, False, best_move
+
+    if search_depth == 1:
+        score, best_move = search_frontier(state, player, moves, root_scores)
+        TT.store(state, score, search_depth, EXACT, best_move, True)
+        return score, True, best_move
+
+    # The best move found for this state in an earlier search is tried first.
+    # Otherwise, if there is a best move from the previous iteration and it is
+    # part of the current possible moves make sure to test it first.
+    first_move = tt_move
+    if first_move is None and depth < len(prev_best_variation):
+        first_move = prev_best_variation[depth]
+
+    if root_scores:
+        ordered_moves = order_root_moves(moves, root_scores)
+    else:
+        ordered_moves = order_moves(moves, first_move, depth)
 
-    maximizing_player = next_player == player
-    moves = state.possible_moves(next_player)
-    # If there is a best move from the previous iteration and it is part of
-    # the current possible moves make sure to test it first.
-    if depth < len(prev_best_variation):
-        previous_best_move = prev_best_variation[depth]
-        moves.sort(key=lambda e: e != previous_best_move)
-
-    best_moves = tuple()
+    best_move = None
     remaining = False
-    if maximizing_player:
-        score = -INF_SCORE
-        for m in moves:
-            res = dfs_alpha_beta(
-                state=state.make_move(m),
-                alpha=alpha,
-                beta=beta,
+    score = -INF_SCORE
+    for i, m in enumerate(ordered_moves):
+        child = _make_move(state, m)
+        if i == 0:
+            child_score, child_remaining, _ = dfs_alpha_beta(
+                state=child,
+                alpha=-beta,
+                beta=-alpha,
                 depth=depth + 1,
-                player=player,
                 max_depth=max_depth,
                 prev_best_variation=prev_best_variation
             )
-            remaining |= res.remaining
-            if res.score > score:
-                best_moves = (m,) + res.moves
-                score = res.score
-            alpha = max(alpha, score)
-
-            # If the score is higher than the lowest the minimizing player can
-            # ensure stop the search since the minimizing player will never
-            # allow this move.
-            if res.score >= beta:
-                break
-    else:
-        score = INF_SCORE
-        for m in moves:
-            res = dfs_alpha_beta(
-                state=state.make_move(m),
-                alpha=alpha,
-                beta=beta,
+        else:
+            # Only check if the move is better than the best move so far.
+            child_score, child_remaining, _ = dfs_alpha_beta(
+                state=child,
+                alpha=-alpha - 1,
+                beta=-alpha,
                 depth=depth + 1,
-                player=player,
                 max_depth=max_depth,
                 prev_best_variation=prev_best_variation
             )
-            remaining |= res.remaining
-            if res.score < score:
-                best_moves = (m,) + res.moves
-                score = res.score
-            beta = min(beta, score)
-
-            # If the score is lower than the highest the maximizing player is
-            # guaranteed stop the search since the maximizing player will never
-            # play this move.
-            if res.score <= alpha:
+            if alpha < -child_score < beta:
+                remaining |= child_remaining
+                child_score, child_remaining, _ = dfs_alpha_beta(
+                    state=child,
+                    alpha=-beta,
+                    beta=child_score,
+                    depth=depth + 1,
+                    max_depth=max_depth,
+                    prev_best_variation=prev_best_variation
+                )
+        if root_scores is not None:
+            root_scores[(m.row, m.col)] = -child_score
+        remaining |= child_remaining
+        if -child_score > score:
+            best_move = m
+            score = -child_score
+        alpha = max(alpha, score)
+
+        # If the best score is higher than the lowest the opponent can ensure
+        # stop the search since the opponent will never allow this state.
+        if score >= beta:
+            record_cutoff(m, depth, max_depth)
+            break
+
+    assert best_move is not None
+    if score <= window_alpha:
+        flag = UPPER
+    elif score >= window_beta:
+        flag = LOWER
+    else:
+        flag = EXACT
+    TT.store(state, score, search_depth, flag, best_move, remaining)
+
+    return score, remaining, best_move
+
+
+ASPIRATION_WINDOW = 8
+"""How much the score can change between iterations without a new search."""
+
+
+def principal_variation(state, max_length):
+    """Find the principal variation from a state in the transposition table.
+
+    The best moves stored in the transposition table are followed until a
+    state is not found or the variation has the maximum length.
+
+    Args:
+        state: The state to start from.
+        max_length: The maximum number of moves in the variation.
+
+    Returns:
+        The moves in the principal variation.
+    """
+    moves = []
+    while len(moves) < max_length:
+        entry = TT.get(state)
+        if entry is None:
+            # The state is not stored if the player to move has to pass.
+            next_player = state.next_player()
+            if next_player is None or next_player == state.last_played.opponent():
                 break
+            state = state.make_pass()
+            continue
+        move = entry.best_move
+        moves.append(move)
+        state = state.make_move(move)
+    return tuple(moves)
+
 
-    assert best_moves is not None
-    return DfsResult(
-        moves=best_moves,
-        score=score,
-        remaining=remaining
-    )
+def reset_search():
+    """Reset the killer moves, the history and the caches before a new search."""
+    for killers in KILLERS:
+        killers[0] = killers[1] = None
+    HISTORY.clear()
+    _CHILD_CACHE.clear()
 
 
 def iterative_deepening(state, player, max_depth=3):
@@ -182,31 +552,70 @@ def iterative_deepening(state, player, max_depth=3):
     a result from the previous iteration the current DFS can be cancelled and
     the previous result can be used instead.
 
+    The transposition table is shared between the iterations, and between
+    searches, so positions that have already been searched deep enough are
+    not searched again. The scores of the moves from the root state are also
+    kept between the iterations and used to order the moves.
+
     Args:
         state: The root state of the search.
-        player: The searching (maximizing) player.
+        player: The searching player, the player to move in the root state.
         max_depth: The maximum depth to search.
 
     Return:
-        A DfsResult object containing the estimated score and principal variation.
+        A DfsResult object containing the estimated score, for the searching
+        player, and principal variation.
     """
+    reset_search()
+
     prev_best_variation = tuple()
+    root_scores = {}
+    # The score of the previous iteration, None before the first iteration.
+    prev_score = None
     for current_depth in range(1, max_depth + 1):
-        res = dfs_alpha_beta(
-            state=state,
-            alpha=-INF_SCORE,
-            beta=INF_SCORE,
-            depth=0,
-            player=player,
-            max_depth=current_depth,
-            prev_best_variation=prev_best_variation
+        # The score is not expected to change much from the previous
+        # iteration so start with a narrow window around it.
+        if prev_score is not None:
+            alpha = max(prev_score - ASPIRATION_WINDOW, -INF_SCORE)
+            beta = min(prev_score + ASPIRATION_WINDOW, INF_SCORE)
+        else:
+            alpha, beta = -INF_SCORE, INF_SCORE
+
+        while True:
+            score, remaining, best_move = dfs_alpha_beta(
+                state=state,
+                alpha=alpha,
+                beta=beta,
+                depth=0,
+                max_depth=current_depth,
+                prev_best_variation=prev_best_variation,
+                root_scores=root_scores
+            )
+            if alpha < score < beta:
+                break
+            # The score is outside of the window, so it is only a bound.
+            # Search again with the full window.
+            alpha, beta = -INF_SCORE, INF_SCORE
+        prev_score = score
+
+        if best_move is None:
+            # The game is over so there are no moves to play.
+            prev_best_variation = ()
+            break
+        prev_best_variation = (best_move,) + principal_variation(
+            state.make_move(best_move), current_depth - 1
         )
-        if not res.remaining or current_depth == max_depth:
-            return res
-        prev_best_variation = res.moves
+        if not remaining or current_depth == max_depth:
+            break
+
+    # The score is for the player to move after the last played move. If
+    # that player has to pass it is for the opponent of the searching player.
+    if state.last_played == player:
+        score = -score
+    return DfsResult(moves=prev_best_variation, score=score, remaining=remaining)
 
 
-class SimpleAgent(Agent):
+class SimpleAgent:
     def __init__(self, player):
         self.player = player
         self.state = None
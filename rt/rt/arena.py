@@ -1,10 +1,10 @@
 import sys
 
 from rt.agent import RandomAgent, SimpleAgent
-from rt.state import GameState, Player
+from rt.state import GameState, Move, Player
 
 
-def get_move(agent, player, state):
+def get_move(agent, state):
     # TODO: Implement timing
     btime = 10000
     wtime = 10000
@@ -13,12 +13,17 @@ def get_move(agent, player, state):
 
     agent.set_state(state)
     bestmove = agent.search(btime=btime, wtime=wtime, binc=binc, winc=winc)
-    for move in state.possible_moves(player):
-        if str(move) == bestmove:
-            return move
-
-    # Invalid move is being played
-    return None
+    # Only the played move is parsed and checked against the board of
+    # possible moves, the list of all moves is not needed.
+    try:
+        move = Move.from_str(bestmove, state)
+    except ValueError:
+        # Invalid move is being played
+        return None
+    if not state.is_possible_move(move):
+        # Invalid move is being played
+        return None
+    return move
 
 
 def main():
@@ -29,9 +34,9 @@ def main():
     state = GameState.start_position()
     while (next_player := state.next_player()) is not None:
         if next_player == Player.Black:
-            bestmove = get_move(player1, next_player, state)
+            bestmove = get_move(player1, state)
         elif next_player == Player.White:
-            bestmove = get_move(player2, next_player, state)
+            bestmove = get_move(player2, state)
 
         # The player made an illegal move so the opponent wins
         if bestmove is None:
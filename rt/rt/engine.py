@@ -60,6 +60,17 @@ class Engine:
         self.author = "<author>"
         self.game_state = None
         self.agent = None
+        self.responses = []
+        # The command expected in each state, the handler that is called with
+        # the arguments of the command and the state after the command.
+        self.transitions = {
+            Engine.State.Uninitialized: ("reversi_v1", self.handle_reversi_v1, Engine.State.AwaitingNewGame),
+            Engine.State.AwaitingNewGame: ("newgame", self.handle_newgame, Engine.State.NewGameCompleted),
+            Engine.State.NewGameCompleted: ("isready", self.handle_isready, Engine.State.AwaitingPosition),
+            Engine.State.AwaitingPosition: ("position", self.handle_position, Engine.State.PositionParsed),
+            Engine.State.PositionParsed: ("isready", self.handle_isready, Engine.State.AwaitingGo),
+            Engine.State.AwaitingGo: ("go", self.handle_go, Engine.State.AwaitingPosition),
+        }
         logger.info("creating engine: %s by %s", self.name, self.author)
 
     def run(self):
@@ -78,6 +89,8 @@ class Engine:
 
         This function will respond to the message by sending text on `stdout`.
         Multiple messages might we written and `stdout` will not be flushed.
+        The messages are collected and written at once when the message has
+        been parsed.
 
         Args:
             msg: The message from the UI.
@@ -85,7 +98,7 @@ class Engine:
         Raises:
             EngineError: If the message was unexpected or wrong.
         """
-        command, *args = msg.split()
+        command, _, args = msg.partition(" ")
 
         # The newgame command is allowed any time after the engine has
         # been initialized. In that case we intercept it here and reset
@@ -97,31 +110,29 @@ class Engine:
             self.agent = None
             self.game_state = None
 
-        match self.state:
-            case Engine.State.Uninitialized:
-                expect("reversi_v1", command)
-                self.send_id()
-                self.state = Engine.State.AwaitingNewGame
-            case Engine.State.AwaitingNewGame:
-                expect("newgame", command)
-                self.setup_agent(args)
-                self.state = Engine.State.NewGameCompleted
-            case Engine.State.NewGameCompleted:
-                expect("isready", command)
-                self.send_ready_ok()
-                self.state = Engine.State.AwaitingPosition
-            case Engine.State.AwaitingPosition:
-                expect("position", command)
-                self.parse_position(args)
-                self.state = Engine.State.PositionParsed
-            case Engine.State.PositionParsed:
-                expect("isready", command)
-                self.send_ready_ok()
-                self.state = Engine.State.AwaitingGo
-            case Engine.State.AwaitingGo:
-                expect("go", command)
-                self.send_best_move(args)
-                self.state = Engine.State.AwaitingPosition
+        expected, handler, next_state = self.transitions[self.state]
+        try:
+            expect(expected, command)
+            handler(args)
+            self.state = next_state
+        finally:
+            self.outstream.writelines(self.responses)
+            self.responses.clear()
+
+    def handle_reversi_v1(self, args):
+        self.send_id()
+
+    def handle_newgame(self, args):
+        self.setup_agent(args.split())
+
+    def handle_isready(self, args):
+        self.send_ready_ok()
+
+    def handle_position(self, args):
+        self.parse_position(args.split())
+
+    def handle_go(self, args):
+        self.send_best_move(args.split())
 
     def send_id(self):
         self.respond(f"id name {self.name}")
@@ -152,21 +163,31 @@ class Engine:
         self.respond("readyok")
 
     def parse_position(self, moves):
+        if not moves:
+            raise EngineError("empty position")
         expect("startpos", moves[0])
         state = GameState.start_position()
         for m in moves[1:]:
-            # TODO: Raise an error if the move is invalid
-            move = Move.from_str(m, state)
+            try:
+                move = Move.from_str(m, state)
+            except ValueError as err:
+                raise EngineError(f"invalid move: {m}") from err
+            if not state.is_possible_move(move):
+                raise EngineError(f"invalid move: {m}")
             state = state.make_move(move)
 
         logger.debug("parsed position: %r", state)
         self.agent.set_state(state)
 
     def respond(self, msg):
-        # Strip to ensure only a single newline is written
-        msg = msg.strip()
+        """Queue a message to the UI.
+
+        Note:
+            The message should not end with a newline, it is added here.
+        """
         logger.debug("send: %s", msg)
-        self.outstream.write(msg + "\n")
+        self.responses.append(msg)
+        self.responses.append("\n")
 
 
 def run():
@@ -1,29 +1,43 @@
 import argparse
+import contextlib
+import multiprocessing
+import multiprocessing.util
+import os
 import subprocess
 import shlex
 import shutil
 import logging
 
-from rt.state import Player, GameState
+from rt.state import Player, GameState, Move
 
 
 logger = logging.getLogger(__name__)
 
 
+def parse_command(cmd):
+    """Split a player command and resolve the path of the executable.
+
+    Raises:
+        ValueError: If the command is empty or the executable is not found.
+    """
+    args = shlex.split(cmd)
+    if len(args) == 0:
+        raise ValueError(f"invalid command {cmd!r}")
+    executable = shutil.which(args[0])
+    if executable is None:
+        raise ValueError(f"invalid command {cmd!r}, {args[0]} not found")
+    args[0] = executable
+    return args
+
+
 def popen(cmd, tag):
-    cmd = shlex.split(cmd)
-    if len(cmd) == 0:
-        raise ValueError(f"invalid command {cmd}")
-    cmd[0] = shutil.which(cmd[0])
-    if any(cmd) == 0:
-        raise ValueError(f"invalid command {cmd}")
+    cmd = parse_command(cmd)
     cmd.append(tag)
     return subprocess.Popen(
         cmd,
-        bufsize=1,  # line buffered
+        bufsize=0,  # unbuffered, PlayerProcess does its own buffering
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
-        text=True,
     )
 
 
@@ -38,6 +52,7 @@ class PlayerProcess:
         self.name = None
         self.author = None
         self.process = None
+        self.read_buffer = bytearray()
 
     def __enter__(self):
         self.process = popen(self.cmd, self.tag)
@@ -52,13 +67,33 @@ class PlayerProcess:
     def __str__(self):
         return f"{self.name} by {self.author}"
 
-    def _write(self, msg):
-        msg = msg.strip()
-        logger.debug("send to %s: %s", self.tag, msg)
-        self.process.stdin.write(msg + "\n")
+    def _write(self, *msgs):
+        """Send one or more messages to the player.
+
+        The messages are joined and written directly to the pipe. A write may
+        be partial so it is repeated until all of the data is written.
+        """
+        data = "".join(f"{msg}\n" for msg in msgs).encode()
+        logger.debug("send to %s: %r", self.tag, data)
+        fd = self.process.stdin.fileno()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
 
     def _read(self):
-        msg = self.process.stdout.readline().strip()
+        """Read a message from the player.
+
+        The output of the player is read in blocks directly from the pipe and
+        split into lines here.
+        """
+        fd = self.process.stdout.fileno()
+        while (end := self.read_buffer.find(b"\n")) == -1:
+            data = os.read(fd, 4096)
+            if not data:
+                raise PlayerError(f"{self.tag} closed its output")
+            self.read_buffer += data
+        msg = self.read_buffer[:end].decode().strip()
+        del self.read_buffer[:end + 1]
         logger.debug("recv from %s: %s", self.tag, msg)
         return msg
 
@@ -93,13 +128,22 @@ class PlayerProcess:
         if msg != "readyok":
             raise PlayerError
 
-    def send_position(self, position):
-        self.expect_enter()
-        self._write(f"position {position}")
+    def send_position_and_go(self, position, btime, wtime, binc, winc):
+        """Send the position, wait for the player to be ready and start the search.
 
-    def send_go(self, btime, wtime, binc, winc):
+        All the messages are sent at once, the player answers them in order.
+        """
         self.expect_enter()
-        self._write(f"go btime={btime} wtime={wtime} binc={binc} winc={winc}")
+        self._write(
+            f"position {position}",
+            "isready",
+            f"go btime={btime} wtime={wtime} binc={binc} winc={winc}",
+        )
+        if self._read() != "readyok":
+            raise PlayerError
+        return self._read_best_move()
+
+    def _read_best_move(self):
         response = self._read()
         command, move = response.split()
         if command != "bestmove":
@@ -107,22 +151,27 @@ class PlayerProcess:
         return move
 
 
-def get_move(player_proc, player, moves, state):
+def get_move(player_proc, moves, state):
     # TODO: Implement timing
     btime = 10000
     wtime = 10000
     binc = 10000
     winc = 10000
 
-    player_proc.send_position(" ".join(moves))
-    player_proc.isready()
-    bestmove = player_proc.send_go(btime=btime, wtime=wtime, binc=binc, winc=winc)
-    for move in state.possible_moves(player):
-        if str(move) == bestmove:
-            return move
-
-    # Invalid move is being played
-    return None
+    bestmove = player_proc.send_position_and_go(
+        " ".join(moves), btime=btime, wtime=wtime, binc=binc, winc=winc
+    )
+    # Only the played move is parsed and checked against the board of
+    # possible moves, the list of all moves is not needed.
+    try:
+        move = Move.from_str(bestmove, state)
+    except ValueError:
+        # Invalid move is being played
+        return None
+    if not state.is_possible_move(move):
+        # Invalid move is being played
+        return None
+    return move
 
 
 def play_game(pb, pw):
@@ -135,9 +184,9 @@ def play_game(pb, pw):
     state = GameState.start_position()
     while (next_player := state.next_player()) is not None:
         if next_player == Player.Black:
-            bestmove = get_move(pb, next_player, moves, state)
+            bestmove = get_move(pb, moves, state)
         elif next_player == Player.White:
-            bestmove = get_move(pw, next_player, moves, state)
+            bestmove = get_move(pw, moves, state)
 
         # The player made an illegal move so the opponent wins
         if bestmove is None:
@@ -150,33 +199,88 @@ def play_game(pb, pw):
     return state.winner()
 
 
+_players = None
+"""The player processes of a worker process, see `_start_players`."""
+_start_error = None
+"""The error raised when starting the players of a worker process, if any."""
+
+
+def _start_players(player1, player2):
+    """Start the player processes of a worker process.
+
+    The players are reused for all games played by the worker and are
+    stopped when the worker exits.
+
+    Note:
+        If the players can not be started the error is kept and raised by
+        `_play_one` instead. An initializer that raises makes the pool
+        replace the worker, starting the players again, forever.
+    """
+    global _players, _start_error
+    try:
+        with contextlib.ExitStack() as stack:
+            p1 = stack.enter_context(PlayerProcess("p1", player1))
+            p2 = stack.enter_context(PlayerProcess("p2", player2))
+            p1.start()
+            p2.start()
+            # The players are running, keep them until the worker exits.
+            players = stack.pop_all()
+    except Exception as err:
+        _start_error = err
+        return
+    multiprocessing.util.Finalize(None, players.close, exitpriority=0)
+    _players = (p1, p2)
+
+
+def _play_one(game):
+    """Play a single game with the player processes of the worker process.
+
+    Args:
+        game: The index of the game. Player 1 plays black in even games and
+              white in odd games.
+
+    Returns:
+        A tuple of the game index, a description of the players and the
+        winner, 1 or 2, or None if the game was a draw.
+    """
+    if _start_error is not None:
+        raise _start_error
+    p1, p2 = _players
+    if game % 2 == 0:
+        winner = play_game(p1, p2)
+        result = {Player.Black: 1, Player.White: 2}.get(winner)
+    else:
+        winner = play_game(p2, p1)
+        result = {Player.Black: 2, Player.White: 1}.get(winner)
+    return game, f"{p1} vs {p2}", result
+
+
 def run_server(player1, player2):
     iterations = 100
     wins_p1 = 0
     wins_p2 = 0
     draws = 0
-    with PlayerProcess("p1", player1) as p1, PlayerProcess("p2", player2) as p2:
-        p1.start()
-        p2.start()
-        print(p1, "vs", p2)
-        for i in range(iterations // 2):
-            winner = play_game(p1, p2)
-            logger.info("game %d, winner %s", i, winner)
-            if winner == Player.Black:
+    # Invalid commands are reported here, before any worker is started.
+    parse_command(player1)
+    parse_command(player2)
+    # The games are independent so they are played in parallel, each worker
+    # process has its own pair of player processes.
+    workers = max(1, (os.cpu_count() or 1) // 2)
+    with multiprocessing.Pool(workers, _start_players, (player1, player2)) as pool:
+        results = pool.imap_unordered(_play_one, range(iterations))
+        for i, (game, players, winner) in enumerate(results):
+            if i == 0:
+                print(players)
+            logger.info("game %d, winner %s", game, winner)
+            if winner == 1:
                 wins_p1 += 1
-            elif winner == Player.White:
+            elif winner == 2:
                 wins_p2 += 1
             else:
                 draws += 1
-        for i in range(iterations // 2, iterations):
-            logger.info("game %d, winner %s", i, winner)
-            winner = play_game(p2, p1)
-            if winner == Player.Black:
-                wins_p2 += 1
-            elif winner == Player.White:
-                wins_p1 += 1
-            else:
-                draws += 1
+        # Let the workers exit normally so that the players are stopped.
+        pool.close()
+        pool.join()
     print("P1:", wins_p1, "P2:", wins_p2, "Draw:", draws)
 
 
@@ -1,22 +1,39 @@
-from dataclasses import dataclass
+import random
 from enum import Enum
 from functools import lru_cache
+from typing import NamedTuple
 
 
 BOARD_SIZE = 8
 
-
-def is_occupied(row, col, board):
-    """Checks if the position is occupied on the board.
-
-    Args:
-        ind: The position on the board in index format.
-        board: The board to check.
-
-    Returns:
-        True if the position is occupied, False otherwise.
-    """
-    return rc2board(row, col) & board != 0
+FULL_BOARD = (1 << (BOARD_SIZE * BOARD_SIZE)) - 1
+"""A board, in board format, where all positions are occupied."""
+INNER_COLUMNS = 0x7E7E7E7E7E7E7E7E
+"""A board, in board format, where all positions but the first and last column are occupied."""
+
+# The shifts, in board format, that move a position one step in a direction
+# together with the positions that can be flipped in that direction. A left
+# shift moves one way along the direction and a right shift the other way.
+# Tokens in the first and last column can never be flipped horizontally or
+# diagonally, masking them also stops the shifts from wrapping around.
+SHIFT_DIRECTIONS = (
+    (1, INNER_COLUMNS),
+    (7, INNER_COLUMNS),
+    (8, FULL_BOARD),
+    (9, INNER_COLUMNS),
+)
+
+# Zobrist keys, one per square for each color. The keys are generated from a
+# fixed seed so that hashes are reproducible between runs.
+_zobrist_rng = random.Random(0x5EED)
+ZOBRIST_BLACK = [_zobrist_rng.getrandbits(64) for _ in range(BOARD_SIZE * BOARD_SIZE)]
+ZOBRIST_WHITE = [_zobrist_rng.getrandbits(64) for _ in range(BOARD_SIZE * BOARD_SIZE)]
+ZOBRIST_LAST_PLAYED_BLACK = _zobrist_rng.getrandbits(64)
+del _zobrist_rng
+ZOBRIST_KEYS = (ZOBRIST_BLACK, ZOBRIST_WHITE)
+"""The Zobrist keys of each player, indexed by `Player.index`."""
+ZOBRIST_FLIP = [b ^ w for b, w in zip(ZOBRIST_BLACK, ZOBRIST_WHITE)]
+"""The change of the Zobrist hash when the token on a position is flipped."""
 
 
 def is_inbounds(row, col):
@@ -87,65 +104,235 @@ def ind2board(ind):
     return 1 << ind
 
 
-def iter_board():
-    for row in range(BOARD_SIZE):
-        for col in range(BOARD_SIZE):
-            yield row, col
-
+def zobrist_board(board, keys):
+    """Compute the Zobrist hash contribution of a board.
 
-def find_flips_along_direction(row, col, dr, dc, my_board, opponent_board):
-    """Perform a search for flips in the direction given by (dr,dc).
+    Args:
+        board: The board in board format.
+        keys: The Zobrist keys for the color occupying the board.
 
-    If we find only opponent tokens and then one of our tokens the
-    search was successful. If we find an empty position or go out of
-    bounds the search was unsuccessful.
+    Returns:
+        The XOR of the keys of all occupied positions.
     """
-    pattern = 0
-    # Scan along the line given by pos and (dr, dc). Worst case we are at the
-    # edges. Scanning until BOARD_SIZE - 1 will then cause us to end up at the
-    # other edge.
-    for i in range(1, BOARD_SIZE):
-        r = row + dr * i
-        c = col + dc * i
-
-        if not is_inbounds(r, c):
-            return 0
-        elif is_occupied(r, c, my_board):
-            return pattern
-        elif is_occupied(r, c, opponent_board):
-            pattern |= rc2board(r, c)
-        else:
-            return 0
-    return 0
+    h = 0
+    while board:
+        lsb = board & -board
+        h ^= keys[lsb.bit_length() - 1]
+        board ^= lsb
+    return h
+
+
+def zobrist_hash(black_board, white_board, last_played):
+    """Compute the Zobrist hash of a position from scratch."""
+    h = zobrist_board(black_board, ZOBRIST_BLACK) ^ zobrist_board(white_board, ZOBRIST_WHITE)
+    if last_played == Player.Black:
+        h ^= ZOBRIST_LAST_PLAYED_BLACK
+    return h
+
+
+def _build_ray_tables():
+    """Build the tables used by `find_flips`, see `RAYS` and `BETWEEN`."""
+    rays = []
+    between = []
+    for ind in range(BOARD_SIZE * BOARD_SIZE):
+        row, col = ind2rc(ind)
+        ind_rays = ([], [])
+        ind_between = [0] * (BOARD_SIZE * BOARD_SIZE)
+        for dr, dc in ((0, 1), (1, -1), (1, 0), (1, 1)):
+            # The first ray goes towards higher indices and the second towards
+            # lower indices.
+            for sign, sign_rays in ((1, ind_rays[0]), (-1, ind_rays[1])):
+                ray = 0
+                r, c = row + sign * dr, col + sign * dc
+                while is_inbounds(r, c):
+                    ind_between[rc2ind(r, c)] = ray
+                    ray |= rc2board(r, c)
+                    r, c = r + sign * dr, c + sign * dc
+                if ray:
+                    sign_rays.append(ray)
+        rays.append((tuple(ind_rays[0]), tuple(ind_rays[1])))
+        between.append(tuple(ind_between))
+    return tuple(rays), tuple(between)
+
+
+RAYS, BETWEEN = _build_ray_tables()
+"""The lines from each position to the edge of the board, and between positions.
+
+`RAYS[ind]` is a pair of tuples with the lines, in board format, from the
+position in index format towards higher and lower indices respectively. The
+position itself is not part of the lines. `BETWEEN[ind][other]` is the
+positions strictly between two positions on the same line, or 0.
+"""
 
 
 def find_flips(row, col, my_board, opponent_board):
-    return (
-        find_flips_along_direction(row, col, 0, 1, my_board, opponent_board)
-        | find_flips_along_direction(row, col, 0, -1, my_board, opponent_board)
-        | find_flips_along_direction(row, col, 1, 0, my_board, opponent_board)
-        | find_flips_along_direction(row, col, -1, 0, my_board, opponent_board)
-        | find_flips_along_direction(row, col, -1, -1, my_board, opponent_board)
-        | find_flips_along_direction(row, col, 1, -1, my_board, opponent_board)
-        | find_flips_along_direction(row, col, -1, 1, my_board, opponent_board)
-        | find_flips_along_direction(row, col, 1, 1, my_board, opponent_board)
-    )
+    """Find the tokens flipped by a move.
+
+    Args:
+        row: The row of the move.
+        col: The column of the move.
+        my_board: The board of the player to move.
+        opponent_board: The board of the opponent.
+
+    Returns:
+        The flipped tokens in board format.
+    """
+    return find_flips_ind(rc2ind(row, col), my_board, opponent_board)
+
+
+def find_flips_ind(ind, my_board, opponent_board):
+    """Find the tokens flipped by a move given in index format.
+
+    This is the integer only kernel of the move generation, used by
+    `find_moves` and the endgame search where the positions are found by
+    scanning bits and are already in index format.
+
+    The first position along each line from the move that is not occupied by
+    the opponent is found with a bit scan. The tokens before it are flipped if
+    it is occupied by one of our tokens.
+
+    Args:
+        ind: The position of the move in index format.
+        my_board: The board of the player to move.
+        opponent_board: The board of the opponent.
+
+    Returns:
+        The flipped tokens in board format.
+    """
+    higher_rays, lower_rays = RAYS[ind]
+    between = BETWEEN[ind]
+    not_opponent = ~opponent_board
+    flip_board = 0
+    for ray in higher_rays:
+        stop = ray & not_opponent
+        if stop:
+            # The lowest set bit is the closest position.
+            stop &= -stop
+            if stop & my_board:
+                flip_board |= between[stop.bit_length() - 1]
+    for ray in lower_rays:
+        stop = ray & not_opponent
+        if stop:
+            # The highest set bit is the closest position.
+            stop = stop.bit_length() - 1
+            if (my_board >> stop) & 1:
+                flip_board |= between[stop]
+    return flip_board
+
+
+def find_move_board(my_board, opponent_board):
+    """Find all positions where a move is possible.
+
+    All positions are searched at the same time, one direction at a time, by
+    shifting the boards. A position is a possible move if it is unoccupied and
+    there is a line of opponent tokens between it and one of our tokens.
+
+    The lines are filled from our tokens with a parallel prefix (Kogge-Stone)
+    fill. The runs of opponent tokens are doubled at each step, so the
+    longest possible line of six opponent tokens is covered in three steps.
+
+    Args:
+        my_board: The board of the player to move.
+        opponent_board: The board of the opponent.
+
+    Returns:
+        The possible moves in board format.
+    """
+    empty = ~(my_board | opponent_board) & FULL_BOARD
+    move_board = 0
+    for shift, mask in SHIFT_DIRECTIONS:
+        flippable = opponent_board & mask
+        shift2 = shift + shift
+        shift4 = shift2 + shift2
+
+        # The filled board holds our tokens and the opponent tokens on lines
+        # from them. The runs hold the positions the fill can advance to by
+        # 1, 2 and then 4 steps through opponent tokens.
+        filled = my_board
+        runs = flippable
+        filled |= runs & (filled << shift)
+        runs &= runs << shift
+        filled |= runs & (filled << shift2)
+        runs &= runs << shift2
+        filled |= runs & (filled << shift4)
+        move_board |= ((filled & flippable) << shift) & empty
+
+        filled = my_board
+        runs = flippable
+        filled |= runs & (filled >> shift)
+        runs &= runs >> shift
+        filled |= runs & (filled >> shift2)
+        runs &= runs >> shift2
+        filled |= runs & (filled >> shift4)
+        move_board |= ((filled & flippable) >> shift) & empty
+    return move_board
+
+
+def has_moves(my_board, opponent_board):
+    """Check if a move is possible.
+
+    Works like `find_move_board` but stops at the first direction where a
+    move is found.
+
+    Args:
+        my_board: The board of the player to move.
+        opponent_board: The board of the opponent.
+
+    Returns:
+        True if there is at least one possible move, False otherwise.
+    """
+    empty = ~(my_board | opponent_board) & FULL_BOARD
+    for shift, mask in SHIFT_DIRECTIONS:
+        flippable = opponent_board & mask
+        shift2 = shift + shift
+        shift4 = shift2 + shift2
+
+        filled = my_board
+        runs = flippable
+        filled |= runs & (filled << shift)
+        runs &= runs << shift
+        filled |= runs & (filled << shift2)
+        runs &= runs << shift2
+        filled |= runs & (filled << shift4)
+        if ((filled & flippable) << shift) & empty:
+            return True
+
+        filled = my_board
+        runs = flippable
+        filled |= runs & (filled >> shift)
+        runs &= runs >> shift
+        filled |= runs & (filled >> shift2)
+        runs &= runs >> shift2
+        filled |= runs & (filled >> shift4)
+        if ((filled & flippable) >> shift) & empty:
+            return True
+    return False
 
 
 def find_moves(player, my_board, opponent_board):
     moves = []
-    for row, col in iter_board():
-        # A move is only valid if the position is unoccupied
-        if not is_occupied(row, col, my_board) and not is_occupied(row, col, opponent_board):
-            flip_board = find_flips(row, col, my_board, opponent_board)
-            # A move is only valid if it flips at least one token
-            if flip_board != 0:
-                moves.append(Move(row, col, flip_board, player))
+    move_board = find_move_board(my_board, opponent_board)
+    # Only the positions of possible moves are visited, lowest index first.
+    while move_board:
+        pos = move_board & -move_board
+        ind = pos.bit_length() - 1
+        row, col = divmod(ind, BOARD_SIZE)
+        flip_board = find_flips_ind(ind, my_board, opponent_board)
+        moves.append(Move(row, col, flip_board, player))
+        move_board ^= pos
     return moves
 
 
+_COL_STR = tuple(chr(col + ord("a")) for col in range(BOARD_SIZE))
+"""The string representation of each column."""
+_ROW_STR = tuple(str(row + 1) for row in range(BOARD_SIZE))
+"""The string representation of each row, 1-based."""
+_HEADER = " " + "".join(_COL_STR)
+"""The column labels above a printed board."""
+
+
 def col_to_string(col):
-    return chr(col + ord("a"))
+    return _COL_STR[col]
 
 
 def parse_move_string(move):
@@ -187,16 +374,21 @@ class Player(Enum):
     Black = "b"
     White = "w"
 
+    def __init__(self, value):
+        # The index of the player's board in `GameState.boards`.
+        self.index = "bw".index(value)
+
     def opponent(self):
-        match self:
-            case Player.Black:
-                return Player.White
-            case Player.White:
-                return Player.Black
+        return _OPPONENTS[self.index]
+
 
+_PLAYERS = (Player.Black, Player.White)
+"""The players, indexed by `Player.index`."""
+_OPPONENTS = (Player.White, Player.Black)
+"""The opponent of each player, indexed by `Player.index`."""
 
-@dataclass
-class Move:
+
+class Move(NamedTuple):
     row: int
     col: int
     flip_board: int
@@ -205,81 +397,160 @@ class Move:
     @staticmethod
     def from_str(move, state):
         row, col, player = parse_move_string(move)
-        match player:
-            case Player.Black:
-                flip_board = find_flips(row, col, state.black_board, state.white_board)
-            case Player.White:
-                flip_board = find_flips(row, col, state.white_board, state.black_board)
+        i = player.index
+        flip_board = find_flips(row, col, state.boards[i], state.boards[1 - i])
         return Move(row, col, flip_board, player)
 
     def __str__(self):
-        return f"{col_to_string(self.col)}{self.row + 1}{self.player.value}"
+        return f"{_COL_STR[self.col]}{_ROW_STR[self.row]}{self.player.value}"
+
+
+_NOT_COMPUTED = object()
+"""Marks a cached value of a GameState that has not been computed yet."""
 
 
 class GameState:
-    """The state of the game at a certain point in time."""
+    """The state of the game at a certain point in time.
 
-    def __init__(self, black_board=0, white_board=0, last_played=Player.White):
-        """Intialize an empty game state.
+    Moves are made by creating new states, a GameState is not modified after
+    it is created. States are equal if the boards and the last player are
+    equal, the Zobrist hash is used as the hash.
+    """
+
+    __slots__ = (
+        "boards",
+        "last_played",
+        "zhash",
+        "_black_moves",
+        "_white_moves",
+        "_next_player",
+    )
+
+    def __init__(self, black_board=0, white_board=0, last_played=Player.White, *, _zhash=None):
+        """Initialize a game state.
 
         Note:
-            This state is likely not a valid game state and needs to be further
-            initialized. Consider using `GameState.start_position()` instead and
-            playing moves.
+            An empty state, `GameState()`, is likely not a valid game state.
+            Consider using `GameState.start_position()` instead and playing
+            moves.
+
+        Args:
+            black_board: The positions occupied by black in board format.
+            white_board: The positions occupied by white in board format.
+            last_played: The player that made the last move.
+            _zhash: The Zobrist hash of the state, only given by `make_move`
+                    and `make_pass` which update it incrementally.
         """
-        self.black_board = black_board
-        self.white_board = white_board
+        self.boards = (black_board, white_board)
         self.last_played = last_played
+        if _zhash is None:
+            _zhash = zobrist_hash(black_board, white_board, last_played)
+        self.zhash = _zhash
+        # The moves and the next player are computed on first use and kept
+        # with the state since the search asks for them repeatedly.
+        self._black_moves = None
+        self._white_moves = None
+        self._next_player = _NOT_COMPUTED
+
+    @property
+    def black_board(self):
+        """The positions occupied by black in board format."""
+        return self.boards[0]
+
+    @property
+    def white_board(self):
+        """The positions occupied by white in board format."""
+        return self.boards[1]
+
+    def __eq__(self, other):
+        if not isinstance(other, GameState):
+            return NotImplemented
+        return self.boards == other.boards and self.last_played == other.last_played
+
+    def __hash__(self):
+        return self.zhash
+
+    def __reduce__(self):
+        # Only the position is pickled, the marker for a value that is not
+        # computed would not survive pickling.
+        return GameState, (self.boards[0], self.boards[1], self.last_played)
 
     @staticmethod
     def start_position():
         """Return a GameState in the starting position."""
-        state = GameState()
-        state.black_board = rc2board(3, 4) | rc2board(4, 3)
-        state.white_board = rc2board(3, 3) | rc2board(4, 4)
-        return state
+        return GameState(
+            black_board=rc2board(3, 4) | rc2board(4, 3),
+            white_board=rc2board(3, 3) | rc2board(4, 4),
+        )
 
     def possible_moves(self, player):
         """Return a list of possible moves for the given player.
 
+        Note:
+            The list is shared between states in the same position and must
+            not be modified.
+
         Args:
             player: The player to find moves for.
 
         Returns:
             A list of moves for the given player at the current GameState.
         """
-        return possible_moves(self, player)
+        i = player.index
+        moves = self._white_moves if i else self._black_moves
+        if moves is None:
+            moves = _possible_moves_cached(self.boards[0], self.boards[1], i)
+            if i:
+                self._white_moves = moves
+            else:
+                self._black_moves = moves
+        return moves
+
+    def is_possible_move(self, move):
+        """Check if a move can be played in the current GameState.
+
+        The move is checked against the board of possible moves, so only its
+        position and player are used and no list of moves is built.
 
-    def _place_token(self, row, col, player):
-        """Place a token on the board.
+        Args:
+            move: The move to check.
 
-        Note:
-            This function does not check if the position is unoccupied.
+        Returns:
+            True if it is the turn of the player of the move and the position
+            is a possible move, False otherwise.
         """
-        pattern = rc2board(row, col)
-        match player:
-            case Player.Black:
-                self.black_board |= pattern
-            case Player.White:
-                self.white_board |= pattern
+        if self.next_player() != move.player:
+            return False
+        i = move.player.index
+        move_board = find_move_board(self.boards[i], self.boards[1 - i])
+        return rc2board(move.row, move.col) & move_board != 0
 
     def next_player(self):
         """Return the next player or None if the game is over."""
-        match self.last_played:
-            case Player.Black:
-                if len(self.possible_moves(Player.White)) > 0:
-                    return Player.White
-                elif len(self.possible_moves(Player.Black)) > 0:
-                    return Player.Black
-                else:
-                    return None
-            case Player.White:
-                if len(self.possible_moves(Player.Black)) > 0:
-                    return Player.Black
-                elif len(self.possible_moves(Player.White)) > 0:
-                    return Player.White
-                else:
-                    return None
+        if self._next_player is _NOT_COMPUTED:
+            self._next_player = self._find_next_player()
+        return self._next_player
+
+    def _find_next_player(self):
+        opponent = self.last_played.opponent()
+        if self._has_moves(opponent):
+            return opponent
+        elif self._has_moves(self.last_played):
+            return self.last_played
+        else:
+            return None
+
+    def _has_moves(self, player):
+        """Check if the player has a possible move.
+
+        Uses the possible moves if they are already known, only the existence
+        of a move is needed otherwise.
+        """
+        i = player.index
+        moves = self._white_moves if i else self._black_moves
+        if moves is not None:
+            return len(moves) > 0
+        return has_moves(self.boards[i], self.boards[1 - i])
 
     def make_move(self, move):
         """Make a move from the given GameState.
@@ -293,12 +564,37 @@ class GameState:
             A new state where the given move has been played.
         """
         # TODO: Add optional assertions here to check that move is actually valid
-        new_state = GameState(self.black_board, self.white_board, move.player)
-        new_state._place_token(move.row, move.col, move.player)
-        new_state.black_board ^= move.flip_board
-        new_state.white_board ^= move.flip_board
+        # The hash is updated incrementally: the placed token is added for the
+        # mover and the flipped tokens change color.
+        ind = rc2ind(move.row, move.col)
+        flip_board = move.flip_board
+        i = move.player.index
+        zhash = self.zhash ^ ZOBRIST_KEYS[i][ind] ^ zobrist_board(flip_board, ZOBRIST_FLIP)
+        if move.player != self.last_played:
+            zhash ^= ZOBRIST_LAST_PLAYED_BLACK
+
+        my_board = self.boards[i] | (1 << ind) | flip_board
+        opponent_board = self.boards[1 - i] ^ flip_board
+        if i == 0:
+            return GameState(my_board, opponent_board, move.player, _zhash=zhash)
+        return GameState(opponent_board, my_board, move.player, _zhash=zhash)
+
+    def make_pass(self):
+        """Pass the turn from the given GameState.
 
-        return new_state
+        Note:
+            Passing is only allowed when the opponent of the last player has no
+            possible moves.
+
+        Returns:
+            A new state where the opponent of the last player has passed.
+        """
+        return GameState(
+            self.boards[0],
+            self.boards[1],
+            self.last_played.opponent(),
+            _zhash=self.zhash ^ ZOBRIST_LAST_PLAYED_BLACK,
+        )
 
     def winner(self):
         b = self.count(Player.Black)
@@ -311,24 +607,19 @@ class GameState:
             return None
 
     def count(self, player):
-        match player:
-            case Player.Black:
-                return bin(self.black_board).count("1")
-            case Player.White:
-                return bin(self.white_board).count("1")
+        return self.boards[player.index].bit_count()
 
     def _board_to_string(self):
-        res = [" abcdefgh"]
+        # The bit strings are reversed so that position i is at index i.
+        black = format(self.black_board, "064b")[::-1]
+        white = format(self.white_board, "064b")[::-1]
+        tokens = "".join(
+            "B" if b == "1" else "W" if w == "1" else "."
+            for b, w in zip(black, white)
+        )
+        res = [_HEADER]
         for row in range(BOARD_SIZE):
-            r = [str(row + 1)]
-            for col in range(BOARD_SIZE):
-                if is_occupied(row, col, self.black_board):
-                    r.append("B")
-                elif is_occupied(row, col, self.white_board):
-                    r.append("W")
-                else:
-                    r.append(".")
-            res.append("".join(r))
+            res.append(f"{_ROW_STR[row]}{tokens[row * BOARD_SIZE:(row + 1) * BOARD_SIZE]}")
         return "\n".join(res)
 
     def __str__(self):
@@ -340,10 +631,22 @@ class GameState:
         return f"GameState(black_board={self.black_board}, white_board={self.white_board}, last_played={self.last_played})"
 
 
-@lru_cache
-def possible_moves(state, player):
-    match player:
-        case Player.Black:
-            return find_moves(player, state.black_board, state.white_board)
-        case Player.White:
-            return find_moves(player, state.white_board, state.black_board)
+POSSIBLE_MOVES_CACHE_SIZE = 1 << 16
+"""The maximum number of positions to keep the possible moves for."""
+
+
+@lru_cache(maxsize=POSSIBLE_MOVES_CACHE_SIZE)
+def _possible_moves_cached(black_board, white_board, player_index):
+    """Return the possible moves for a player in a position.
+
+    The cache is keyed by the boards, and the index of the player, instead of
+    the GameState since the same position is reached by different sequences
+    of moves.
+
+    Note:
+        The returned list is shared and must not be modified.
+    """
+    boards = (black_board, white_board)
+    return find_moves(
+        _PLAYERS[player_index], boards[player_index], boards[1 - player_index]
+    )
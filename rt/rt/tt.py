@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from enum import Enum, auto
+from typing import NamedTuple
+
+from rt.state import Move
+
+
+# Transposition table flags, describing how a stored score relates to the
+# true score of the position.
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class Entry(NamedTuple):
+    """A search result stored in a `TranspositionTable`."""
+    score: int
+    """The score of the state, from the perspective of the player to move."""
+    depth: int
+    """The number of plies that were searched below the state."""
+    flag: int
+    """How the score relates to the true score, `EXACT`, `LOWER` or `UPPER`."""
+    best_move: Move | None
+    """The best move found in the state or None if there are no moves."""
+    remaining: bool
+    """True if the search could have gone deeper, see `DfsResult.remaining`."""
+
+
+class TranspositionTable:
+    """A bounded map from game states to search results.
+
+    The states are keyed by their Zobrist hash, `GameState.zhash`, which is
+    computed incrementally when moves are made. When the table is full the
+    least recently stored entry is evicted. Looking up an entry does not
+    count as a use, a state is stored again when it is searched again.
+
+    Note:
+        Only the hash is stored, not the state, so the states are never
+        compared. Two states with the same hash share an entry and the result
+        of one is silently used for the other. With 64-bit hashes this is
+        unlikely, and storing the states would keep them, and their cached
+        moves, alive for as long as they are in the table.
+    """
+
+    class Replacement(Enum):
+        Always = auto()
+        """A new result for a state always replaces the stored result."""
+        DepthPreferred = auto()
+        """A new result only replaces a result from an equal or shallower search."""
+
+    def __init__(self, size=1 << 20, replacement=Replacement.Always):
+        """Create a new, empty, TranspositionTable.
+
+        Args:
+            size: The maximum number of entries in the table.
+            replacement: The policy for replacing the result of a state that
+                         is already stored.
+        """
+        self.size = size
+        self.replacement = replacement
+        self._entries = OrderedDict()
+
+    def get(self, state):
+        """Return the stored entry for the state or None if there is none."""
+        return self._entries.get(state.zhash)
+
+    def store(self, state, score, depth, flag, best_move, remaining):
+        """Store a search result for the state, see `Entry`."""
+        key = state.zhash
+        entries = self._entries
+        if self.replacement == TranspositionTable.Replacement.DepthPreferred:
+            entry = entries.get(key)
+            if entry is not None and entry.depth > depth:
+                entries.move_to_end(key)
+                return
+        entries[key] = Entry(score, depth, flag, best_move, remaining)
+        entries.move_to_end(key)
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries."""
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,130 @@
+import random
+import unittest
+
+from rt import agent
+from rt.state import FULL_BOARD, GameState, Player
+
+
+def negamax(state, depth):
+    """A plain negamax search, the score for the player to move in state."""
+    player = state.last_played.opponent()
+    next_player = state.next_player()
+    if depth == 0 or next_player is None:
+        return agent.score_func(state, player)
+    if next_player != player:
+        # Passing does not increase the depth, like in the searches.
+        return -negamax(state.make_pass(), depth)
+    return max(-negamax(state.make_move(m), depth - 1) for m in state.possible_moves(player))
+
+
+def random_states(count, seed, min_ply=4, max_ply=60, accept=None):
+    """Return states from random games that are not over.
+
+    If accept is given only the states it returns True for are returned.
+    """
+    rng = random.Random(seed)
+    states = []
+    while len(states) < count:
+        state = GameState.start_position()
+        plies = rng.randint(min_ply, max_ply)
+        for _ in range(plies):
+            next_player = state.next_player()
+            if next_player is None:
+                break
+            state = state.make_move(rng.choice(state.possible_moves(next_player)))
+        if state.next_player() is None:
+            continue
+        if accept is not None and not accept(state):
+            continue
+        states.append(state)
+    return states
+
+
+def must_pass(state):
+    """Check if the player to move in state has to pass."""
+    return state.next_player() == state.last_played
+
+
+def has_pass_near(state, depth=2):
+    """Check if a player has to pass within depth plies from state."""
+    next_player = state.next_player()
+    if next_player is None:
+        return False
+    if next_player != state.last_played.opponent():
+        return True
+    if depth == 0:
+        return False
+    return any(
+        has_pass_near(state.make_move(m), depth - 1)
+        for m in state.possible_moves(next_player)
+    )
+
+
+class TestIterativeDeepening(unittest.TestCase):
+    def setUp(self):
+        agent.TT.clear()
+        agent.reset_search()
+
+    def check_search(self, states, depths):
+        for state in states:
+            player = state.next_player()
+            for depth in depths:
+                with self.subTest(state=repr(state), depth=depth):
+                    agent.TT.clear()
+                    res = agent.iterative_deepening(state, player, max_depth=depth)
+                    expected = negamax(state, depth)
+                    if player != state.last_played.opponent():
+                        expected = -expected
+                    self.assertEqual(res.score, expected)
+
+                    # The first move of the variation must be a possible move
+                    # that gives the score.
+                    move = res.moves[0]
+                    self.assertIn(move, state.possible_moves(player))
+                    child = state.make_move(move)
+                    self.assertEqual(-negamax(child, depth - 1), expected)
+
+    def test_midgame(self):
+        self.check_search(random_states(12, seed=1, max_ply=40), range(1, 5))
+
+    def test_endgame(self):
+        self.check_search(random_states(12, seed=2, min_ply=48), range(1, 5))
+
+    def test_passing(self):
+        self.check_search(random_states(8, seed=3, min_ply=30, accept=has_pass_near), range(1, 5))
+
+    def test_passing_root(self):
+        self.check_search(random_states(4, seed=5, min_ply=40, accept=must_pass), range(1, 5))
+
+    def test_root_scores(self):
+        for state in random_states(8, seed=6, max_ply=50):
+            player = state.next_player()
+            for depth in range(1, 4):
+                with self.subTest(state=repr(state), depth=depth):
+                    agent.TT.clear()
+                    root_scores = {}
+                    agent.dfs_alpha_beta(
+                        state, -agent.INF_SCORE, agent.INF_SCORE, 0, depth, (), root_scores
+                    )
+                    # Every root move is scored. At depth one all the states
+                    # after the moves are leaves so the scores are exact.
+                    moves = state.possible_moves(player)
+                    self.assertEqual(set(root_scores), {(m.row, m.col) for m in moves})
+                    if depth == 1:
+                        for m in moves:
+                            expected = -negamax(state.make_move(m), 0)
+                            self.assertEqual(root_scores[(m.row, m.col)], expected)
+
+    def test_game_over(self):
+        # Black has every position but one, so neither player can move.
+        state = GameState(black_board=FULL_BOARD ^ 1)
+        for player in Player:
+            with self.subTest(player=player):
+                res = agent.iterative_deepening(state, player, max_depth=3)
+                self.assertEqual(res.moves, ())
+                self.assertEqual(res.score, 63 if player == Player.Black else -63)
+                self.assertFalse(res.remaining)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import io
+import random
+import unittest
+
+from rt.engine import Engine, EngineError
+from rt.state import GameState, Move
+
+
+class RecordingAgent:
+    """An agent that records the states it is given and plays the first move."""
+
+    def __init__(self, player):
+        self.player = player
+        self.states = []
+
+    def set_state(self, state):
+        self.states.append(state)
+
+    def search(self, btime, wtime, binc, winc):
+        state = self.states[-1]
+        return str(state.possible_moves(self.player)[0])
+
+
+def game_with_pass(seed=0):
+    """Return the moves of a random game where a player passes, and the states after them."""
+    rng = random.Random(seed)
+    while True:
+        state = GameState.start_position()
+        moves = []
+        states = []
+        passed = False
+        while (player := state.next_player()) is not None:
+            passed |= player == state.last_played
+            move = rng.choice(state.possible_moves(player))
+            state = state.make_move(move)
+            moves.append(str(move))
+            states.append(state)
+        if passed:
+            return moves, states
+
+
+def move_out_of_turn(moves, states):
+    """Return the moves up to a state and a move by the player that is not to move.
+
+    The position of the move is also a possible move for the player to move,
+    so only the player makes it invalid.
+    """
+    for i, state in enumerate(states):
+        player = state.next_player()
+        if player is None:
+            break
+        positions = {(m.row, m.col) for m in state.possible_moves(player)}
+        for m in state.possible_moves(player.opponent()):
+            if (m.row, m.col) in positions:
+                return moves[:i + 1], str(m)
+    raise ValueError("no move out of turn found")
+
+
+class TestEngine(unittest.TestCase):
+    def setUp(self):
+        self.new_engine()
+
+    def new_engine(self):
+        self.out = io.StringIO()
+        self.engine = Engine(RecordingAgent, instream=None, outstream=self.out)
+
+    def responses(self):
+        lines = self.out.getvalue().splitlines()
+        self.out.seek(0)
+        self.out.truncate()
+        return lines
+
+    def start_game(self, player="b"):
+        self.engine.parse("reversi_v1")
+        self.engine.parse(f"newgame {player}")
+        self.engine.parse("isready")
+        self.responses()
+
+    def test_handshake_and_search(self):
+        self.engine.parse("reversi_v1")
+        self.assertEqual(
+            self.responses(),
+            ["id name TESTENGINE 1.0", "id author <author>", "reversi_v1_ok"],
+        )
+        self.engine.parse("newgame b")
+        self.engine.parse("isready")
+        self.assertEqual(self.responses(), ["readyok"])
+        self.engine.parse("position startpos")
+        self.engine.parse("isready")
+        self.engine.parse("go btime=1000 wtime=1000 binc=0 winc=0")
+        self.assertEqual(self.responses(), ["readyok", "bestmove d3b"])
+        self.assertEqual(self.engine.agent.states, [GameState.start_position()])
+
+    def test_empty_message(self):
+        self.assertRaises(EngineError, self.engine.parse, "")
+        self.start_game()
+        self.assertRaises(EngineError, self.engine.parse, "")
+        self.assertEqual(self.engine.state, Engine.State.AwaitingPosition)
+
+    def test_unexpected_command(self):
+        self.assertRaises(EngineError, self.engine.parse, "isready")
+        self.start_game()
+        self.assertRaises(EngineError, self.engine.parse, "go btime=1 wtime=1 binc=0 winc=0")
+        self.assertEqual(self.engine.state, Engine.State.AwaitingPosition)
+
+    def test_legal_position(self):
+        self.start_game()
+        self.engine.parse("position startpos d3b c3w")
+        expected = GameState.start_position()
+        for m in ("d3b", "c3w"):
+            expected = expected.make_move(Move.from_str(m, expected))
+        self.assertEqual(self.engine.agent.states, [expected])
+        self.assertEqual(self.engine.state, Engine.State.PositionParsed)
+
+    def test_position_with_pass(self):
+        moves, states = game_with_pass()
+        for i in range(1, len(moves) + 1):
+            with self.subTest(moves=i):
+                self.new_engine()
+                self.start_game()
+                self.engine.parse(" ".join(["position", "startpos"] + moves[:i]))
+                self.assertEqual(self.engine.agent.states, [states[i - 1]])
+
+    def test_invalid_positions(self):
+        moves, states = game_with_pass()
+        prefix, out_of_turn = move_out_of_turn(moves, states)
+        # The move after the pass is made by the same player as the move
+        # before it, the opponent can not play it.
+        i = next(i for i in range(1, len(moves)) if moves[i][-1] == moves[i - 1][-1])
+        wrong_player = moves[i][:-1] + ("w" if moves[i][-1] == "b" else "b")
+        invalid = [
+            "",
+            "d3b",
+            "startpos d3w",
+            "startpos d3b d3w",
+            "startpos d3b d4w",
+            "startpos a1b",
+            "startpos d3b c3b",
+            "startpos d3x",
+            "startpos z9b",
+            "startpos d3",
+            " ".join(["startpos"] + moves[:i] + [wrong_player]),
+            " ".join(["startpos"] + prefix + [out_of_turn]),
+        ]
+        self.start_game()
+        for position in invalid:
+            with self.subTest(position=position):
+                self.assertRaises(EngineError, self.engine.parse, f"position {position}".strip())
+                # The engine still waits for a valid position.
+                self.assertEqual(self.engine.state, Engine.State.AwaitingPosition)
+        self.assertEqual(self.engine.agent.states, [])
+        self.engine.parse("position startpos d3b")
+        self.assertEqual(self.engine.state, Engine.State.PositionParsed)
+
+
+if __name__ == "__main__":
+    unittest.main()
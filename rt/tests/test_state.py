@@ -0,0 +1,174 @@
+import pickle
+import random
+import unittest
+
+from rt.state import (
+    BOARD_SIZE,
+    GameState,
+    Player,
+    find_flips,
+    find_flips_ind,
+    find_move_board,
+    find_moves,
+    has_moves,
+    rc2board,
+)
+
+
+DIRECTIONS = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if (dr, dc) != (0, 0)]
+
+
+def scan_flips(row, col, my_board, opponent_board):
+    """Find the flipped tokens one square at a time, the reference for the bit tricks."""
+    if rc2board(row, col) & (my_board | opponent_board):
+        return 0
+    flip_board = 0
+    for dr, dc in DIRECTIONS:
+        line = 0
+        r, c = row + dr, col + dc
+        while 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE and rc2board(r, c) & opponent_board:
+            line |= rc2board(r, c)
+            r, c = r + dr, c + dc
+        if 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE and rc2board(r, c) & my_board:
+            flip_board |= line
+    return flip_board
+
+
+def scan_moves(player, my_board, opponent_board):
+    """Find the possible moves one square at a time, in index order."""
+    moves = []
+    for row in range(BOARD_SIZE):
+        for col in range(BOARD_SIZE):
+            flip_board = scan_flips(row, col, my_board, opponent_board)
+            if flip_board:
+                moves.append((row, col, flip_board, player))
+    return moves
+
+
+def random_boards(count, seed):
+    """Return pairs of disjoint random boards with varying densities."""
+    rng = random.Random(seed)
+    boards = []
+    for _ in range(count):
+        my_board = 0
+        opponent_board = 0
+        density = rng.random()
+        for ind in range(BOARD_SIZE * BOARD_SIZE):
+            if rng.random() < density:
+                if rng.random() < 0.5:
+                    my_board |= 1 << ind
+                else:
+                    opponent_board |= 1 << ind
+        boards.append((my_board, opponent_board))
+    return boards
+
+
+def game_boards(count, seed):
+    """Return the boards of the positions reached in random games."""
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        state = GameState.start_position()
+        while (player := state.next_player()) is not None:
+            boards.append((state.black_board, state.white_board))
+            state = state.make_move(rng.choice(state.possible_moves(player)))
+        boards.append((state.black_board, state.white_board))
+    return boards
+
+
+class TestMoveGeneration(unittest.TestCase):
+    def check_boards(self, boards):
+        for black_board, white_board in boards:
+            for player, my_board, opponent_board in (
+                (Player.Black, black_board, white_board),
+                (Player.White, white_board, black_board),
+            ):
+                with self.subTest(black_board=black_board, white_board=white_board, player=player):
+                    expected = scan_moves(player, my_board, opponent_board)
+                    moves = find_moves(player, my_board, opponent_board)
+                    self.assertEqual([tuple(m) for m in moves], expected)
+                    self.assertEqual(has_moves(my_board, opponent_board), bool(expected))
+
+                    move_board = 0
+                    for row, col, _, _ in expected:
+                        move_board |= rc2board(row, col)
+                    self.assertEqual(find_move_board(my_board, opponent_board), move_board)
+
+                    for ind in range(BOARD_SIZE * BOARD_SIZE):
+                        row, col = divmod(ind, BOARD_SIZE)
+                        flip_board = scan_flips(row, col, my_board, opponent_board)
+                        if flip_board:
+                            self.assertEqual(find_flips_ind(ind, my_board, opponent_board), flip_board)
+                            self.assertEqual(find_flips(row, col, my_board, opponent_board), flip_board)
+
+    def test_random_boards(self):
+        self.check_boards(random_boards(300, seed=1))
+
+    def test_game_positions(self):
+        self.check_boards(game_boards(300, seed=2))
+
+    def test_full_lines(self):
+        # A move at a corner flipping a full line of six tokens in each
+        # direction along the edges and the diagonal.
+        my_board = rc2board(0, 7) | rc2board(7, 0) | rc2board(7, 7)
+        opponent_board = 0
+        for i in range(1, 7):
+            opponent_board |= rc2board(0, i) | rc2board(i, 0) | rc2board(i, i)
+        self.check_boards([(my_board, opponent_board), (opponent_board, my_board)])
+        self.assertEqual(find_flips(0, 0, my_board, opponent_board), opponent_board)
+
+
+class TestGameState(unittest.TestCase):
+    def test_possible_moves_and_next_player(self):
+        for black_board, white_board in game_boards(200, seed=3):
+            for last_played in Player:
+                state = GameState(black_board, white_board, last_played)
+                with self.subTest(state=repr(state)):
+                    for player in Player:
+                        i = player.index
+                        expected = scan_moves(player, state.boards[i], state.boards[1 - i])
+                        self.assertEqual([tuple(m) for m in state.possible_moves(player)], expected)
+
+                    opponent = last_played.opponent()
+                    if state.possible_moves(opponent):
+                        expected = opponent
+                    elif state.possible_moves(last_played):
+                        expected = last_played
+                    else:
+                        expected = None
+                    # A fresh state so that has_moves is used instead of the moves.
+                    self.assertEqual(GameState(black_board, white_board, last_played).next_player(), expected)
+
+    def test_incremental_hash(self):
+        rng = random.Random(4)
+        for _ in range(20):
+            state = GameState.start_position()
+            while (player := state.next_player()) is not None:
+                if player == state.last_played:
+                    state = state.make_pass()
+                else:
+                    state = state.make_move(rng.choice(state.possible_moves(player)))
+                fresh = GameState(state.black_board, state.white_board, state.last_played)
+                self.assertEqual(state, fresh)
+                self.assertEqual(state.zhash, fresh.zhash)
+
+    def test_equality_and_pickling(self):
+        state = GameState.start_position()
+        move = state.possible_moves(state.next_player())[0]
+        state = state.make_move(move)
+        self.assertEqual(state, GameState(state.black_board, state.white_board, state.last_played))
+        self.assertNotEqual(state, GameState(state.black_board, state.white_board, state.last_played.opponent()))
+        self.assertNotEqual(state, GameState(state.white_board, state.black_board, state.last_played))
+
+        # The cached values are not pickled and are computed again.
+        state.next_player()
+        for cached in (state, GameState(state.black_board, state.white_board, state.last_played)):
+            copy = pickle.loads(pickle.dumps(cached))
+            self.assertEqual(copy, state)
+            self.assertEqual(hash(copy), hash(state))
+            self.assertEqual(copy.next_player(), state.next_player())
+            self.assertEqual(copy.possible_moves(copy.next_player()), state.possible_moves(state.next_player()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+
+from rt.state import GameState
+from rt.tt import EXACT, LOWER, UPPER, Entry, TranspositionTable
+
+
+def states(count):
+    """Return count different states, following the first move from the start."""
+    state = GameState.start_position()
+    res = []
+    while len(res) < count:
+        res.append(state)
+        player = state.next_player()
+        if player == state.last_played:
+            state = state.make_pass()
+        else:
+            state = state.make_move(state.possible_moves(player)[0])
+    return res
+
+
+class TestTranspositionTable(unittest.TestCase):
+    def test_store_and_get(self):
+        tt = TranspositionTable(size=8)
+        a, b = states(2)
+        self.assertIsNone(tt.get(a))
+        move = a.possible_moves(a.next_player())[0]
+        tt.store(a, 5, 3, EXACT, move, True)
+        self.assertEqual(tt.get(a), Entry(5, 3, EXACT, move, True))
+        # Equal states have the same hash and share the entry.
+        self.assertEqual(tt.get(GameState(a.black_board, a.white_board, a.last_played)), tt.get(a))
+        self.assertIsNone(tt.get(b))
+        self.assertEqual(len(tt), 1)
+
+        tt.clear()
+        self.assertEqual(len(tt), 0)
+        self.assertIsNone(tt.get(a))
+
+    def test_least_recently_stored_is_evicted(self):
+        tt = TranspositionTable(size=3)
+        a, b, c, d, e = states(5)
+        for s in (a, b, c):
+            tt.store(s, 0, 1, EXACT, None, False)
+        # Looking up a does not keep it.
+        tt.get(a)
+        tt.store(d, 0, 1, EXACT, None, False)
+        self.assertEqual(len(tt), 3)
+        self.assertIsNone(tt.get(a))
+        for s in (b, c, d):
+            self.assertIsNotNone(tt.get(s))
+
+        # Storing to an existing entry makes it the most recent.
+        tt.store(b, 1, 1, EXACT, None, False)
+        tt.store(e, 0, 1, EXACT, None, False)
+        self.assertIsNone(tt.get(c))
+        self.assertEqual(tt.get(b).score, 1)
+
+    def test_always_replace(self):
+        tt = TranspositionTable(size=8)
+        (a,) = states(1)
+        tt.store(a, 10, 5, LOWER, None, True)
+        tt.store(a, 3, 2, UPPER, None, False)
+        self.assertEqual(tt.get(a), Entry(3, 2, UPPER, None, False))
+
+    def test_depth_preferred(self):
+        tt = TranspositionTable(size=2, replacement=TranspositionTable.Replacement.DepthPreferred)
+        a, b, c = states(3)
+        tt.store(a, 10, 5, EXACT, None, True)
+        # A shallower result is ignored, an equal or deeper one replaces it.
+        tt.store(a, 3, 2, EXACT, None, True)
+        self.assertEqual(tt.get(a).score, 10)
+        tt.store(a, 4, 5, LOWER, None, False)
+        self.assertEqual(tt.get(a), Entry(4, 5, LOWER, None, False))
+        tt.store(a, 6, 7, EXACT, None, True)
+        self.assertEqual(tt.get(a), Entry(6, 7, EXACT, None, True))
+
+        # An ignored result still makes the entry the most recent.
+        tt.store(b, 0, 1, EXACT, None, True)
+        tt.store(a, 0, 1, EXACT, None, True)
+        tt.store(c, 0, 1, EXACT, None, True)
+        self.assertIsNone(tt.get(b))
+        self.assertEqual(tt.get(a).score, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()